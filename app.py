@@ -1,21 +1,151 @@
 from flask import Flask, render_template, request, send_file
-from imposition import Imposer
-from pypdf import PdfReader
+from imposition import Imposer, mupdf_lock
+import pymupdf
+import hashlib
 import io
+import os
+import queue
 import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 # LIMITS
 MAX_QUEUE_SIZE = 8
+MAX_CONCURRENT = os.cpu_count() or 1
 MAX_FILE_SIZE = 60 * 1024 * 1024  # 60 MB
+MAX_CACHE_SIZE = 256 * 1024 * 1024  # 256 MB of cached results
+CACHE_TTL = 5 * 60  # seconds a result is kept in memory
+CACHE_SWEEP_INTERVAL = 10  # seconds
+READ_CHUNK_SIZE = 1024 * 1024  # 1 MB
+JOB_TIMEOUT = 100  # seconds; stays under gunicorn's --timeout 120
 
-# Semaphore for the Queue (Waiting Room)
-# We use non-blocking acquire to reject users when full
-queue_semaphore = threading.BoundedSemaphore(value=MAX_QUEUE_SIZE)
+# Bounded Work Queue (Waiting Room)
+# Jobs are (future, fn, args); put_nowait rejects users when full
+work_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+
+
+class ResultCache:
+    """
+    Small thread-safe cache of (upload digest, n_up) -> imposed PDF bytes.
+    Entries expire ttl seconds after they are stored and the oldest are
+    evicted first when over max_bytes. Memory only.
+    """
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        # Insertion order == expiry order, since every entry gets the same TTL
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.size += len(value)
+            # Evict the oldest results until back under budget
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def purge(self):
+        with self._lock:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._entries:
+            key, (expires_at, value) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
+            self.size -= len(value)
+
+# Re-submitting the same PDF (e.g. to retry a download) skips imposition.
+# Results are dropped after CACHE_TTL, as stated on the privacy page.
+result_cache = ResultCache(MAX_CACHE_SIZE, CACHE_TTL)
+
+
+def cache_sweeper():
+    """
+    Drops expired results even when no requests arrive.
+    """
+    while True:
+        time.sleep(CACHE_SWEEP_INTERVAL)
+        result_cache.purge()
+
+
+def impose_pdf(data, n_up, cache_key):
+    """
+    Runs one imposition job, caches it and returns the imposed PDF bytes.
+    Caching here (not in the request) keeps the result even if the request timed out.
+    """
+    imposer = Imposer(io.BytesIO(data), n_up)
+    result = imposer.generate().getvalue()
+    result_cache.put(cache_key, result)
+    return result
+
+
+def processing_worker():
+    """
+    Processing worker (one Chair): takes jobs off the queue and resolves their futures.
+    """
+    while True:
+        job, fn, args = work_queue.get()
+        # Skip jobs whose request already gave up waiting
+        if not job.set_running_or_notify_cancel():
+            continue
+        try:
+            job.set_result(fn(*args))
+        except Exception as e:
+            job.set_exception(e)
+
+
+_threads_started = False
+_threads_lock = threading.Lock()
+
+
+def start_background_threads():
+    """
+    Starts the processing workers and the cache sweeper, once per process.
+    Called lazily from /process rather than at import time, because spawned
+    pool workers re-import this module (as __mp_main__ under `python app.py`)
+    and must not start threads of their own.
+    """
+    global _threads_started
+    with _threads_lock:
+        if _threads_started:
+            return
+        # Up to MAX_CONCURRENT impositions run at once, one per core
+        for _ in range(MAX_CONCURRENT):
+            threading.Thread(target=processing_worker, daemon=True).start()
+        threading.Thread(target=cache_sweeper, daemon=True).start()
+        _threads_started = True
 
-# Lock for the Processing (The Chair)
-processing_lock = threading.Lock()
 
 app = Flask(__name__)
+# Reject oversized bodies at WSGI ingress, before any upload is parsed.
+# Small allowance on top of the file limit for multipart framing + form fields.
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 64 * 1024
+
+@app.errorhandler(413)
+def request_too_large(e):
+    message = f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB."
+    # /count-pages is called via fetch and reports its errors as JSON
+    if request.path == '/count-pages':
+        return {'error': message}, 413
+    return message, 413
 
 @app.route('/', methods=['GET'])
 def index():
@@ -59,6 +189,8 @@ def sitemap():
 
 @app.route('/process', methods=['POST'])
 def process():
+    start_background_threads()
+
     if 'pdf_file' not in request.files:
         return 'No file uploaded', 400
     
@@ -73,35 +205,48 @@ def process():
         
     # Process the file
     try:
-        # 1. Check File Size (Content-Length)
-        if request.content_length and request.content_length > MAX_FILE_SIZE:
-             return f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB.", 413
+        # 1. Read the upload into memory once, hashing it as it streams in.
+        # (Request size is already capped by MAX_CONTENT_LENGTH)
+        # Bounded: stop as soon as the upload passes the limit.
+        digest = hashlib.blake2b(digest_size=16)
+        chunks = []
+        size = 0
+        while True:
+            chunk = file.stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            # Check actual file size
+            if size > MAX_FILE_SIZE:
+                return f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB.", 413
+            digest.update(chunk)
+            chunks.append(chunk)
+        data = b"".join(chunks)
+        del chunks
 
-        # 2. Try to Enter Queue
-        # acquire(blocking=False) returns False if queue is full
-        if not queue_semaphore.acquire(blocking=False):
-             return "Server is currently full. Please wait a moment and try again.", 503
+        # Same file + same layout: reuse the previous result
+        cache_key = (digest.hexdigest(), n_up)
+        result = result_cache.get(cache_key)
+        if result is None:
+            # 2. Try to Enter Queue
+            # put_nowait raises queue.Full if the waiting room is full
+            job = Future()
+            try:
+                work_queue.put_nowait((job, impose_pdf, (data, n_up, cache_key)))
+            except queue.Full:
+                return "Server is currently full. Please wait a moment and try again.", 503
 
-        try:
-            # 3. entered queue, now wait for processing lock
-            with processing_lock:
-                 # Check actual file size again
-                file.seek(0, 2) # Seek to end
-                size = file.tell()
-                file.seek(0) # Reset
-                
-                if size > MAX_FILE_SIZE:
-                    return f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB.", 413
-
-                # Process
-                imposer = Imposer(file.stream, n_up)
-                output_pdf = imposer.generate()
-        finally:
-            # Always release the queue spot
-            queue_semaphore.release()
+            # 3. entered queue, now wait for a worker to finish the job
+            try:
+                result = job.result(timeout=JOB_TIMEOUT)
+            except FutureTimeoutError:
+                # Drops the job if no worker has picked it up yet; a running
+                # job still caches its result, so a retry can pick it up
+                job.cancel()
+                return "Processing took too long. Please try again in a moment.", 504
         
         return send_file(
-            output_pdf,
+            io.BytesIO(result),
             as_attachment=True,
             download_name=f'imposed_{n_up}up_{file.filename}',
             mimetype='application/pdf'
@@ -119,16 +264,14 @@ def count_pages():
     if file.filename == '':
         return {'error': 'No file selected'}, 400
         
+    # Read-only and cheap: runs outside the queue so file analysis
+    # stays responsive while impositions are running, but still under
+    # mupdf_lock since PyMuPDF must not run on several threads at once.
     try:
-        if not queue_semaphore.acquire(blocking=False):
-             return {'error': 'Server is currently full. Please wait a moment.'}, 503
-
-        try:
-             with processing_lock:
-                reader = PdfReader(file.stream)
-                count = len(reader.pages)
-        finally:
-             queue_semaphore.release()
+        data = file.stream.read()
+        with mupdf_lock:
+            with pymupdf.open(stream=data, filetype="pdf") as doc:
+                count = doc.page_count
 
         return {'pages': count}
     except Exception as e:
@@ -1,259 +1,408 @@
 import math
 import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4, portrait
-from pypdf import PdfReader, PdfWriter, PageObject, Transformation
-from reportlab.lib.units import mm
+import functools
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pymupdf
+
+# PARALLELISM
+MAX_WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_SHEETS = 16  # Below this, a job runs as one pool task (splitting costs more IPC than it saves)
+
+# LABELS
+LABEL_FONT_SIZE = 5
+# Helvetica-Bold AFM advance width (1/1000 em) of the digits 0-9. Labels are
+# page numbers, and every Helvetica-Bold digit has this same width.
+HELV_BOLD_DIGIT_WIDTH = 556
+
+# Fixed content-stream fragments for the overlay
+_CUT_HDR = b"0.5 0.5 0.5 RG\n0.5 w\n[2 2] 0 d\n"  # grey, 0.5pt, dashed
+_LABEL_HDR = b"0 0 0 rg\nBT /F1 %d Tf\n" % LABEL_FONT_SIZE
+_LABEL_FONT = "<</Type/Font/Subtype/Type1/BaseFont/Helvetica-Bold/Encoding/WinAnsiEncoding>>"
+
+# PyMuPDF is not thread-safe: any MuPDF work done in this process (rather
+# than in a pool worker) must hold this lock
+mupdf_lock = threading.Lock()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """
+    Returns the shared worker pool, creating it on first use.
+    Uses "spawn" since the web server process is multi-threaded.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(broken):
+    """
+    Drops a broken worker pool (e.g. a worker was OOM-killed) so the next job gets a fresh one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+@functools.lru_cache(maxsize=64)
+def _best_grid(n):
+    """
+    Calculate the best grid (cols, rows) for N pages on A4 Portrait.
+    Finds a grid such that cols * rows >= n.
+    Minimizes (Waste + AspectRatioDiff), where waste is cols * rows - n and
+    the target rows/cols ratio is ~1.414 (A4 H/W). This allows small waste
+    (e.g. 1 page) if it provides much better shape (e.g. 2x3 vs 1x5).
+    Ties keep the smallest column count.
+    """
+    limit = int(math.ceil(math.sqrt(n))) + 2
+    
+    best_key = float('inf')
+    best_c, best_r = 1, n
+    for c in range(1, limit + 1):
+        r = -(-n // c)  # ceil(n / c)
+        key = (r * c - n) + abs(r / c - 1.414)
+        if key < best_key:
+            best_key, best_c, best_r = key, c, r
+    return best_c, best_r
+
+
+def _render_sheet_range(pdf_bytes, n_up, start, stop):
+    """
+    Worker entry point: imposes sheets [start, stop) and returns them as PDF bytes.
+    """
+    imposer = Imposer(io.BytesIO(pdf_bytes), n_up)
+    out = imposer._render_sheets(start, stop)
+    data = out.tobytes()
+    out.close()
+    return data
+
+
+def _save(out):
+    """
+    Serializes a PyMuPDF Document into a BytesIO and closes it.
+    """
+    # Serialize straight into the returned stream, then free the document
+    # so only one copy of the output is alive.
+    # Kept in memory on purpose: uploads are never written to disk.
+    # garbage=0/deflate=False are PyMuPDF's defaults, spelled out so nobody
+    # "optimizes" this into garbage=4: each source page is placed exactly
+    # once, so there is nothing worth deduplicating, and source streams are
+    # copied as-is (already compressed).
+    output_stream = io.BytesIO()
+    out.save(output_stream, garbage=0, deflate=False)
+    out.close()
+    output_stream.seek(0)
+    return output_stream
+
+
+def _append_contents(page, data):
+    """
+    Appends raw content-stream bytes to a PyMuPDF page as a new /Contents entry.
+    """
+    doc = page.parent
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<<>>")
+    # Left uncompressed: overlay streams are tiny, so deflate costs CPU for no gain
+    doc.update_stream(xref, data, compress=False)
+    refs = " ".join(f"{x} 0 R" for x in page.get_contents() + [xref])
+    doc.xref_set_key(page.xref, "Contents", f"[{refs}]")
+
+
+def _set_font_resource(page, name, font_xref):
+    """
+    Points /Resources/Font/<name> of a PyMuPDF page at an existing font object.
+    """
+    doc = page.parent
+    kind, value = doc.xref_get_key(page.xref, "Resources")
+    if kind == "xref":
+        # Indirect resources dict: set the key on that object itself
+        doc.xref_set_key(int(value.split()[0]), f"Font/{name}", f"{font_xref} 0 R")
+    else:
+        doc.xref_set_key(page.xref, f"Resources/Font/{name}", f"{font_xref} 0 R")
+
 
 class Imposer:
     def __init__(self, input_pdf_stream, pages_per_sheet_n):
         """
         Initialize the Imposer.
-        :param input_pdf_stream: File-like object or path to input PDF.
+        :param input_pdf_stream: File-like object containing the input PDF.
         :param pages_per_sheet_n: Integer, number of pages per physical sheet side (N-up).
         """
-        self.reader = PdfReader(input_pdf_stream)
-        self.total_input_pages = len(self.reader.pages)
+        # Raw bytes are kept so worker processes can re-open the source cheaply
+        self._pdf_bytes = input_pdf_stream.read()
+        with mupdf_lock:
+            self.src = pymupdf.open(stream=self._pdf_bytes, filetype="pdf")
+            self.total_input_pages = self.src.page_count
+            # Source page sizes, resolved once instead of per grid cell.
+            # /Rotate is cleared first (self.src is a private in-memory copy):
+            # show_pdf_page sizes from the rotated rect but draws the unrotated
+            # page, which shrinks and clips rotated pages. Like the old pypdf
+            # merge, pages are placed unrotated.
+            self._dims = []
+            for page in self.src:
+                if page.rotation:
+                    page.set_rotation(0)
+                self._dims.append((page.rect.width, page.rect.height))
         self.n_up = pages_per_sheet_n
         
         # CHANGED: Use A4 Portrait (210mm x 297mm)
-        self.sheet_width, self.sheet_height = portrait(A4)
+        self.sheet_width, self.sheet_height = 210 * 72 / 25.4, 297 * 72 / 25.4
         
         # Calculate grid dimensions (cols x rows)
-        self.cols, self.rows = self.calculate_grid(self.n_up)
+        self.cols, self.rows = _best_grid(self.n_up)
         
-    def calculate_grid(self, n):
-        """
-        Calculate the best grid (cols, rows) for N pages on A4 Portrait.
-        Finds a grid such that cols * rows >= n.
-        Prioritizes:
-        1. Minimal waste (cols * rows - n)
-        2. Portrait shape (rows >= cols) to match A4.
-        """
-        best_rows = n
-        best_cols = 1
-        min_waste = float('inf')
+        # Calculate cell dimensions
+        # We want "no much gap", just "small gap with line of separation"
+        # Let's define specific margin/gap if needed, or just full bleed with lines.
+        # User said "filled and no much gap between the pages just a small gap with line of separation".
+        # We will assume the visible cut lines are drawn ON TOP of the pages or in the gutter.
+        # Let's reserve a tiny gutter for the line? 
+        # Or just draw the line at the boundary.
+        self._cw = self.sheet_width / self.cols
+        self._ch = self.sheet_height / self.rows
         
-        # Heuristic: Iterate cols from 1 up to sqrt(n) + something
-        # For N=5, sqrt=2.2. Cols to check: 1, 2.
-        # Col 1: Rows 5. Cap=5. Waste=0.
-        # Col 2: Rows 3. Cap=6. Waste=1.
+        # Cut lines are identical on every sheet side, so build their
+        # content-stream operators once (PDF space, bottom-left origin).
+        cut_lines = [_CUT_HDR]
+        # Vertical
+        for c in range(1, self.cols):
+            x = c * self._cw
+            cut_lines.append(b"%.2f 0 m %.2f %.2f l S\n" % (x, x, self.sheet_height))
+        # Horizontal
+        for r in range(1, self.rows):
+            y = r * self._ch
+            cut_lines.append(b"0 %.2f m %.2f %.2f l S\n" % (y, self.sheet_width, y))
+        self._cut_lines = b"".join(cut_lines)
         
-        # We want to check reasonably up to n.
-        limit = int(math.ceil(math.sqrt(n))) + 2
+        # Cell origins (bottom-left, PDF space) per grid column / row
+        self._col_x = [c * self._cw for c in range(self.cols)]
+        self._row_y = [self.sheet_height - (r + 1) * self._ch for r in range(self.rows)]
+        # Grid positions in stack order as (page_offset, row, target_col).
+        # Stack index k (0 to N-1) runs Left-to-Right, Top-to-Bottom.
+        # SEQUENTIAL N-UP LOGIC (User Request)
+        # Sheet 0 (Front) contains pairs 0, 1, 2... N-1
+        # Sheet 1 (Front) contains pairs N, N+1... 2N-1
+        # so page = sheet_idx * 2N + page_offset, where page_offset is
+        # 2k + 1 on the front (odd pages 1, 3, 5...) and 2k + 2 on the
+        # back (even pages 2, 4, 6...).
+        # BACK SIDE MIRRORING: the back flips the GRID column index.
+        self._front_positions = [(2 * (r * self.cols + c) + 1, r, c)
+                                 for r in range(self.rows) for c in range(self.cols)]
+        self._back_positions = [(2 * (r * self.cols + c) + 2, r, self.cols - 1 - c)
+                                for r in range(self.rows) for c in range(self.cols)]
         
-        candidates = []
+        # (src_w, src_h) -> placement; input PDFs usually have one page size
+        self._placements = {}
         
-        for c in range(1, limit + 1):
-            r = math.ceil(n / c)
-            capacity = r * c
-            waste = capacity - n
-            
-            # Penalize wide layouts on portrait sheet
-            # Ratio of sheet is ~1.41 (H/W)
-            # We prefer R/C close to 1.41
-            # Or just prefer R >= C
-            
-            candidates.append((c, r, waste))
+    def generate(self):
+        """
+        Generate the imposed PDF.
+        Sheets are rendered in worker processes; large jobs are split into
+        contiguous sheet ranges across several workers.
+        Closes the source document, so each Imposer generates once.
+        Returns a BytesIO object containing the PDF.
+        """
+        sheets_per_stack = math.ceil(self.total_input_pages / (2 * self.n_up))
+        workers = min(MAX_WORKERS, sheets_per_stack)
+        
+        # Rendering always goes through the pool, even for small jobs: PyMuPDF
+        # does not support multi-threaded use, and callers (the web app) run
+        # several jobs on threads of one process. Per-core parallelism comes
+        # from the worker processes instead.
+        if sheets_per_stack < PARALLEL_MIN_SHEETS or workers < 2:
+            workers = 1
+        
+        pool = _get_pool()
+        try:
+            return self._render_parallel(pool, sheets_per_stack, workers)
+        except BrokenProcessPool:
+            # A worker died; replace the pool and finish this job in-process
+            _reset_pool(pool)
+            with mupdf_lock:
+                return _save(self._render_sheets(0, sheets_per_stack))
+        finally:
+            with mupdf_lock:
+                self.src.close()
 
-        # Sort candidates
-        # New Heuristic: minimize (Waste + AspectRatioDiff)
-        # This allows small waste (e.g. 1 page) if it provides much better shape (e.g. 2x3 vs 1x5).
+    def _render_parallel(self, pool, sheets_per_stack, workers):
+        """
+        Renders all sheets as contiguous ranges in the worker pool and merges them in order.
+        """
+        # One contiguous range per worker: one round trip per worker, and
+        # the shared label font/resources are copied once per chunk only.
+        chunk = max(1, math.ceil(sheets_per_stack / workers))
+        starts = list(range(0, sheets_per_stack, chunk)) or [0]
+        stops = [min(start + chunk, sheets_per_stack) for start in starts]
         
-        target_ratio = 1.414
+        results = pool.map(_render_sheet_range,
+                           [self._pdf_bytes] * len(starts),
+                           [self.n_up] * len(starts),
+                           starts, stops)
         
-        candidates.sort(key=lambda x: x[2] + abs((x[1]/x[0]) - target_ratio))
+        if len(starts) == 1:
+            # Single range: the worker's bytes already are the final PDF
+            return io.BytesIO(next(results))
         
-        best = candidates[0]
-        return best[0], best[1]
+        # Merge the chunks in order. map() submits every chunk up front and
+        # the chunks finish at about the same time, so most chunks' bytes are
+        # alive next to the output anyway; each is only released once merged.
+        # In-process MuPDF work, so it runs under mupdf_lock.
+        with mupdf_lock:
+            out = pymupdf.open()
+            try:
+                for part_bytes in results:
+                    with pymupdf.open(stream=part_bytes, filetype="pdf") as part:
+                        out.insert_pdf(part)
+                    del part_bytes
+            except BaseException:
+                out.close()
+                raise
+            return _save(out)
 
-    def generate(self):
+    def _render_sheets(self, start, stop):
         """
-        Generate the imposed PDF.
-        Returns a BytesIO object containing the PDF.
+        Renders sheets [start, stop) (front + back each) into a new PyMuPDF Document.
         """
         sheets_per_stack = math.ceil(self.total_input_pages / (2 * self.n_up))
         
-        output_writer = PdfWriter()
-        
-        # Calculate cell dimensions
-        # We want "no much gap", just "small gap with line of separation"
-        # Let's define specific margin/gap if needed, or just full bleed with lines.
-        # User said "filled and no much gap between the pages just a small gap with line of separation".
-        # We will assume the visible cut lines are drawn ON TOP of the pages or in the gutter.
-        # Let's reserve a tiny gutter for the line? 
-        # Or just draw the line at the boundary.
+        out = pymupdf.open()
         
-        cell_width = self.sheet_width / self.cols
-        cell_height = self.sheet_height / self.rows
+        # Label font: one Helvetica-Bold object shared by every sheet side
+        font_xref = out.get_new_xref()
+        out.update_object(font_xref, _LABEL_FONT)
         
         # Generate Sheets
-        for sheet_idx in range(sheets_per_stack):
+        for sheet_idx in range(start, stop):
             # Create Front Side
-            front_page = PageObject.create_blank_page(width=self.sheet_width, height=self.sheet_height)
-            self._fill_sheet_side(front_page, sheet_idx, sheets_per_stack, is_front=True, 
-                                  cell_width=cell_width, cell_height=cell_height)
-            self._draw_overlay(front_page, cell_width, cell_height, sheet_idx, True)
-            output_writer.add_page(front_page)
+            front_page = out.new_page(width=self.sheet_width, height=self.sheet_height)
+            self._fill_sheet_side(front_page, sheet_idx, sheets_per_stack, is_front=True)
+            self._draw_overlay(front_page, sheet_idx, True, font_xref)
             
             # Create Back Side
-            back_page = PageObject.create_blank_page(width=self.sheet_width, height=self.sheet_height)
-            self._fill_sheet_side(back_page, sheet_idx, sheets_per_stack, is_front=False,
-                                  cell_width=cell_width, cell_height=cell_height)
+            back_page = out.new_page(width=self.sheet_width, height=self.sheet_height)
+            self._fill_sheet_side(back_page, sheet_idx, sheets_per_stack, is_front=False)
              # Cut lines on back too
-            self._draw_overlay(back_page, cell_width, cell_height, sheet_idx, False)
-            output_writer.add_page(back_page)
+            self._draw_overlay(back_page, sheet_idx, False, font_xref)
             
-        output_stream = io.BytesIO()
-        output_writer.write(output_stream)
-        output_stream.seek(0)
-        return output_stream
+        return out
 
-    def _draw_overlay(self, page_obj, cell_width, cell_height, sheet_idx, is_front):
+    def _draw_overlay(self, page_obj, sheet_idx, is_front, font_xref):
         """
-        Draws cut lines and page numbers on a temporary PDF page and merges it.
+        Appends cut lines and page numbers to the sheet as one raw content stream.
+        Coordinates are in PDF space (bottom-left origin).
         """
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=(self.sheet_width, self.sheet_height))
+        # 1. Cut Lines (precomputed)
+        ops = [b"q\n", self._cut_lines]
+            
+        # 2. Page Numbers
+        rects = []
+        labels = []
+        positions = self._front_positions if is_front else self._back_positions
+        first_page_num = sheet_idx * 2 * self.n_up
+        for page_offset, row, target_col in positions:
+            page_num = first_page_num + page_offset
+            
+            # Check bounds (page numbers only grow along positions)
+            if page_num > self.total_input_pages:
+                break
+            
+            # Top-Left of the cell
+            cell_x = self._col_x[target_col]
+            cell_y = self._row_y[row] + self._ch # Top Y of cell
+            
+            # Draw Text
+            text = b"%d" % page_num
+            text_x = cell_x + 10  # Moved away from corner
+            text_y = cell_y - 14 # Moved down from top
+            
+            # White background rect for readability
+            text_width = len(text) * HELV_BOLD_DIGIT_WIDTH * LABEL_FONT_SIZE / 1000
+            rects.append(b"%.2f %.2f %.2f 8 re\n" % (text_x - 2, text_y - 2, text_width + 4))
+            
+            labels.append(b"1 0 0 1 %.2f %.2f Tm (%s) Tj\n" % (text_x, text_y, text))
+
+        # Batched: one fill-color switch + one fill for all background rects,
+        # then a single text object (one color switch, one Tf) for all labels
+        if labels:
+            ops.append(b"1 1 1 rg\n")
+            ops.extend(rects)
+            ops.append(b"f\n")
+            ops.append(_LABEL_HDR)
+            ops.extend(labels)
+            ops.append(b"ET\n")
+        ops.append(b"Q\n")
         
-        # 1. Draw Cut Lines
-        can.setStrokeColorRGB(0.5, 0.5, 0.5) 
-        can.setLineWidth(0.5)
-        can.setDash([2, 2])
+        # Sheets are blank pages we build ourselves, so /F1 can't collide
+        _set_font_resource(page_obj, "F1", font_xref)
+        _append_contents(page_obj, b"".join(ops))
+
+    def _compute_placement(self, src_w, src_h):
+        """
+        Returns (scaled_w, scaled_h, off_x, off_y) for a src_w x src_h page fitted into a cell.
+        """
+        # User requested to minimize wasted space and match tightly packed reference images.
+        # Setting padding_factor to 1.0 means the source page determines its own margins.
+        padding_factor = 1.0 
         
-        # Vertical
-        for c in range(1, self.cols):
-            x = c * cell_width
-            can.line(x, 0, x, self.sheet_height)
-        # Horizontal
-        for r in range(1, self.rows):
-            y = r * cell_height
-            can.line(0, y, self.sheet_width, y)
-            
-        # 2. Draw Page Numbers
-        can.setFillColorRGB(0, 0, 0)
-        can.setFont("Helvetica-Bold", 5)
+        avail_w = self._cw * padding_factor
+        avail_h = self._ch * padding_factor
         
-        # Reset dash for text background box?
-        # Actually just draw text with a small white background retangle for visibility?
-        # Or just black text. Let's start with just text, maybe add a small white box behind it.
+        scale_w = avail_w / src_w
+        scale_h = avail_h / src_h
+        scale = min(scale_w, scale_h) # Uniform scaling
         
-        for row in range(self.rows):
-            for col in range(self.cols):
-                stack_index = row * self.cols + col
-                global_pair_index = (sheet_idx * self.n_up) + stack_index
-                
-                if is_front:
-                    page_num = (global_pair_index * 2) + 1
-                else:
-                    page_num = (global_pair_index * 2) + 2
-                
-                # Check bounds
-                if page_num > self.total_input_pages:
-                    continue
-                    
-                # Calculate Position
-                target_col = col
-                if not is_front:
-                    target_col = self.cols - 1 - col
-                
-                # Top-Left of the cell
-                cell_x = target_col * cell_width
-                cell_y = self.sheet_height - (row * cell_height) # Top Y of cell
-                
-                # Draw Text
-                text = f"{page_num}"
-                text_x = cell_x + 10  # Moved away from corner
-                text_y = cell_y - 14 # Moved down from top
-                
-                # Optional: White background rect for readability
-                can.setFillColorRGB(1, 1, 1) # White
-                text_width = can.stringWidth(text, "Helvetica-Bold", 5)
-                can.rect(text_x - 2, text_y - 2, text_width + 4, 8, fill=1, stroke=0)
-                
-                can.setFillColorRGB(0, 0, 0) # Black
-                can.drawString(text_x, text_y, text)
-
-        can.save()
-        packet.seek(0)
+        # Center in cell
+        scaled_src_w = src_w * scale
+        scaled_src_h = src_h * scale
         
-        overlay_pdf = PdfReader(packet)
-        page_obj.merge_page(overlay_pdf.pages[0])
+        off_x_in_cell = (self._cw - scaled_src_w) / 2
+        off_y_in_cell = (self._ch - scaled_src_h) / 2
+        return scaled_src_w, scaled_src_h, off_x_in_cell, off_y_in_cell
 
-    def _fill_sheet_side(self, canvas_page, sheet_idx, sheets_per_stack, is_front, cell_width, cell_height):
+    def _fill_sheet_side(self, canvas_page, sheet_idx, sheets_per_stack, is_front):
         """
-        Places the correct source pages onto the canvas_page (PyPDF PageObject).
+        Places the correct source pages onto the canvas_page (PyMuPDF Page).
         """
-        # Iterate through the N grid positions (stacks)
-        for row in range(self.rows):
-            for col in range(self.cols):
-                # Calculate stack index k (0 to N-1)
-                # Order: Typically Left-to-Right, Top-to-Bottom
-                stack_index = row * self.cols + col
-                
-                # SEQUENTIAL N-UP LOGIC (User Request)
-                # Sheet 0 (Front) contains pairs 0, 1, 2... N-1
-                # Sheet 1 (Front) contains pairs N, N+1... 2N-1
-                
-                # Global pair index across all sheets
-                global_pair_index = (sheet_idx * self.n_up) + stack_index
-                
-                if is_front:
-                    # Odd pages: 1, 3, 5... (1-based)
-                    # Pair 0 -> Page 1
-                    # Pair 1 -> Page 3
-                    current_page_num_1base = (global_pair_index * 2) + 1
-                else:
-                    # Even pages: 2, 4, 6... (1-based)
-                    # Pair 0 -> Page 2
-                    # Pair 1 -> Page 4
-                    current_page_num_1base = (global_pair_index * 2) + 2
-                
-                # Check if this page exists in input
-                if current_page_num_1base <= self.total_input_pages:
-                    source_page = self.reader.pages[current_page_num_1base - 1]
-                    
-                    # Transformation Matrix Calculation
-                    mb = source_page.mediabox
-                    src_w = float(mb.width)
-                    src_h = float(mb.height)
-                    
-                    # User requested to minimize wasted space and match tightly packed reference images.
-                    # Setting padding_factor to 1.0 means the source page determines its own margins.
-                    padding_factor = 1.0 
-                    
-                    avail_w = cell_width * padding_factor
-                    avail_h = cell_height * padding_factor
-                    
-                    scale_w = avail_w / src_w
-                    scale_h = avail_h / src_h
-                    scale = min(scale_w, scale_h) # Uniform scaling
-                    
-                    # Center in cell
-                    scaled_src_w = src_w * scale
-                    scaled_src_h = src_h * scale
-                    
-                    off_x_in_cell = (cell_width - scaled_src_w) / 2
-                    off_y_in_cell = (cell_height - scaled_src_h) / 2
-                    
-                    # Cell Position on Sheet
-                    # Y is typically bottom-up in PDF. 
-                    # Row 0 is Top.
-                    
-                    target_col = col
-                    target_row = row
-                    
-                    if not is_front:
-                        # BACK SIDE MIRRORING (Horizontal flip of the GRID column index)
-                        target_col = self.cols - 1 - col
-                                            
-                    # Calculate final coordinates (bottom-left corner of the placed page)
-                    cell_x_global = target_col * cell_width
-                    cell_y_global = self.sheet_height - (target_row + 1) * cell_height
-                    
-                    final_x = cell_x_global + off_x_in_cell
-                    final_y = cell_y_global + off_y_in_cell
-                    
-                    op = Transformation().scale(scale, scale).translate(final_x, final_y)
-                    canvas_page.merge_transformed_page(source_page, op)
+        # Iterate through the N grid positions (stacks), see _front_positions
+        positions = self._front_positions if is_front else self._back_positions
+        first_page_num = sheet_idx * 2 * self.n_up
+        for page_offset, row, target_col in positions:
+            current_page_num_1base = first_page_num + page_offset
+            
+            # Check if this page exists in input (page numbers only grow along positions)
+            if current_page_num_1base > self.total_input_pages:
+                break
+            
+            source_pno = current_page_num_1base - 1
+            
+            # Placement Rect Calculation
+            src_w, src_h = self._dims[source_pno]
+            
+            # Scale + centering offsets, shared by all same-sized pages
+            placement = self._placements.get((src_w, src_h))
+            if placement is None:
+                placement = self._compute_placement(src_w, src_h)
+                self._placements[(src_w, src_h)] = placement
+            scaled_src_w, scaled_src_h, off_x_in_cell, off_y_in_cell = placement
+            
+            # Calculate final coordinates (bottom-left corner of the placed page)
+            # Y is typically bottom-up in PDF. Row 0 is Top.
+            final_x = self._col_x[target_col] + off_x_in_cell
+            final_y = self._row_y[row] + off_y_in_cell
+            
+            # Convert to PyMuPDF's top-left origin
+            target_rect = pymupdf.Rect(final_x, self.sheet_height - final_y - scaled_src_h,
+                                    final_x + scaled_src_w, self.sheet_height - final_y)
+            canvas_page.show_pdf_page(target_rect, self.src, source_pno)
 